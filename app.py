@@ -1,7 +1,9 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import pdfplumber
-from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz, process, utils
+from rapidfuzz.distance import Indel
 from io import BytesIO
 
 st.set_page_config(page_title="Universal File Data Joiner", layout="wide")
@@ -13,16 +15,22 @@ uploaded_file2 = st.file_uploader("Upload Second File", type=["pdf", "csv", "xls
 
 join_type = st.selectbox("Join type (when tables found)", ["inner", "left", "right", "outer"])
 
+# Uploads kept per cached function; the cache is shared by every session on the server
+CACHE_ENTRIES = 32
+
+# Upper bound on cells in one text score matrix (uint8, so ~10 MB)
+MAX_SCORE_CELLS = 10_000_000
+
 # ===== Extraction Functions =====
 def extract_from_file(file):
     """Auto-detect file type and extract table or text."""
     name = file.name.lower()
     if name.endswith(".pdf"):
-        df = extract_tables_pdfplumber(file)
+        df, lines = extract_all(file.getvalue())
         if df is not None:
             return df, None
         else:
-            return None, extract_text_clean(file)
+            return None, lines
     elif name.endswith(".csv"):
         return pd.read_csv(file), None
     elif name.endswith((".xlsx", ".xls")):
@@ -34,50 +42,121 @@ def extract_from_file(file):
         st.warning(f"Unsupported file format: {name}")
         return None, None
 
-def extract_tables_pdfplumber(file):
+def page_lines(page):
+    """Return the stripped, non-empty text lines of a PDF page."""
     try:
-        tables = []
-        with pdfplumber.open(file) as pdf:
-            for page in pdf.pages:
-                table = page.extract_table()
-                if table:
-                    df = pd.DataFrame(table[1:], columns=table[0])
-                    tables.append(df)
-        if tables:
-            return pd.concat(tables, ignore_index=True)
+        txt = page.extract_text()
     except Exception as e:
-        st.warning(f"Table extraction error: {e}")
-    return None
+        st.warning(f"Text extraction error: {e}")
+        return []
+    if not txt:
+        return []
+    return [ln.strip() for ln in txt.splitlines() if ln.strip()]
+
+def realign_rows(table, header):
+    """Reorder a table's data rows onto header, pairing repeated or empty names in order."""
+    def keys(names):
+        seen = {}
+        for name in names:
+            seen[name] = seen.get(name, 0) + 1
+            yield name, seen[name]
+    index = {key: j for j, key in enumerate(keys(table[0]))}
+    positions = [index.get(key) for key in keys(header)]
+    return [[row[j] if j is not None else None for j in positions] for row in table[1:]]
 
-def extract_text_clean(file):
-    lines = []
+@st.cache_data(show_spinner=False, max_entries=CACHE_ENTRIES)
+def extract_all(file_bytes):
+    """Extract the table and the text lines of a PDF in a single pass over its pages."""
+    header, rows, lines = None, [], []
+    table_ok = True
+    # text is only needed while no table has been found; keep the skipped pages
+    # so their text can be recovered if table extraction fails later on
+    skipped = []
     try:
-        with pdfplumber.open(file) as pdf:
+        with pdfplumber.open(BytesIO(file_bytes)) as pdf:
+            # pages are parsed serially: they share one pdfminer stream, and the layout
+            # analysis is pure Python, so a thread pool would race on seeks without a speedup
             for page in pdf.pages:
-                txt = page.extract_text()
-                if txt:
-                    for ln in txt.splitlines():
-                        ln = ln.strip()
-                        if ln:
-                            lines.append(ln)
+                if table_ok:
+                    try:
+                        table = page.extract_table()
+                    except Exception as e:
+                        st.warning(f"Table extraction error: {e}")
+                        table_ok, table = False, None
+                        for p in skipped:
+                            lines.extend(page_lines(p))
+                        skipped = []
+                    if table:
+                        if header is None:
+                            header = table[0]
+                        if table[0] == header:
+                            rows.extend(table[1:])
+                        elif {n for n in table[0] if n} & {n for n in header if n}:
+                            # header differs but shares names: realign onto the first page's columns
+                            rows.extend(realign_rows(table, header))
+                        elif len(table[0]) == len(header):
+                            # continuation page without a repeated header: its first row is data
+                            rows.extend(table)
+                        else:
+                            st.warning("Skipped a table page whose columns don't match the first page.")
+                if header is None or not table_ok:
+                    lines.extend(page_lines(page))
+                else:
+                    skipped.append(page)
     except Exception as e:
-        st.warning(f"Text extraction error: {e}")
-    return lines
+        st.warning(f"PDF extraction error: {e}")
+        return None, lines
+    if header is not None and table_ok:
+        return pd.DataFrame(rows, columns=header), lines
+    return None, lines
 
+@st.cache_data(show_spinner=False, max_entries=CACHE_ENTRIES)
 def find_common_text(text1, text2, threshold=85):
-    common = []
-    for t1 in text1:
-        for t2 in text2:
-            if fuzz.token_set_ratio(t1, t2) >= threshold:
-                common.append(t1)
-                break
-    # preserve uniqueness
-    seen, uniq = set(), []
-    for x in common:
-        if x not in seen:
-            seen.add(x)
-            uniq.append(x)
-    return uniq
+    if not text1 or not text2:
+        return []
+    # repeated lines (headers, footers) only need scoring once; dict.fromkeys keeps order
+    uniq1 = list(dict.fromkeys(text1))
+    uniq2 = list(dict.fromkeys(text2))
+    # identical lines are common without scoring, unless they normalize to nothing
+    # (e.g. "-----"), which the scorer rates 0; only the rest go through the fuzzy pass
+    s2 = set(uniq2)
+    matched = {t for t in uniq1 if t in s2 and utils.default_process(t)}
+    remaining = [t for t in uniq1 if t not in s2]
+    if remaining:
+        # score rows in blocks so the score matrix stays bounded on huge PDFs; lines are
+        # normalized once, and the cutoff keeps scores that round up to threshold
+        step = max(1, MAX_SCORE_CELLS // len(uniq2))
+        for start in range(0, len(remaining), step):
+            block = remaining[start:start + step]
+            scores = process.cdist(block, uniq2, scorer=fuzz.token_set_ratio,
+                                   processor=utils.default_process,
+                                   score_cutoff=threshold - 0.5, dtype=np.uint8, workers=-1)
+            mask = scores.max(axis=1) >= threshold
+            matched.update(block[i] for i in np.flatnonzero(mask))
+    return [t for t in uniq1 if t in matched]
+
+def find_join_columns(df1, df2, threshold=80):
+    """Return the best (col1, col2) pair with similar names, or None."""
+    cols1 = [str(c).lower() for c in df1.columns]
+    cols2 = [str(c).lower() for c in df2.columns]
+
+    # an exact name match always scores 100, so skip fuzzy scoring entirely
+    exact = set(cols1) & set(cols2)
+    if exact:
+        for col1, name1 in zip(df1.columns, cols1):
+            if name1 in exact:
+                return col1, df2.columns[cols2.index(name1)]
+
+    if not cols1 or not cols2:
+        return None
+    # score every column pair in one call and take the first highest-scoring pair;
+    # Indel similarity is fuzz.ratio on a 0-1 scale, rounded to whole points as before
+    scores = np.rint(process.cdist(cols1, cols2, scorer=Indel.normalized_similarity,
+                                   score_cutoff=threshold / 100, dtype=np.float64) * 100)
+    i, j = np.unravel_index(scores.argmax(), scores.shape)
+    if scores[i, j] > threshold:
+        return df1.columns[i], df2.columns[j]
+    return None
 
 # ===== Core Logic =====
 if uploaded_file1 and uploaded_file2:
@@ -89,19 +168,10 @@ if uploaded_file1 and uploaded_file2:
         if df1 is not None and df2 is not None:
             st.success("✅ Found structured data in both files. Performing automatic join...")
 
-            join_cols = []
-            for col1 in df1.columns:
-                for col2 in df2.columns:
-                    try:
-                        score = fuzz.ratio(str(col1).lower(), str(col2).lower())
-                    except:
-                        score = 0
-                    if score > 80:
-                        join_cols.append((col1, col2, score))
+            join_cols = find_join_columns(df1, df2)
 
             if join_cols:
-                join_cols = sorted(join_cols, key=lambda x: x[2], reverse=True)
-                col1, col2, _ = join_cols[0]
+                col1, col2 = join_cols
                 st.write(f"Joining on columns: **{col1}** ↔ **{col2}**")
                 common = pd.merge(df1, df2, left_on=col1, right_on=col2, how=join_type)
 
@@ -109,8 +179,10 @@ if uploaded_file1 and uploaded_file2:
                     st.info("Join produced no rows. Try a different join type.")
                 else:
                     st.dataframe(common)
-                    csv = common.to_csv(index=False).encode("utf-8")
-                    st.download_button("⬇️ Download Joined Data as CSV", csv, "joined_data.csv", "text/csv")
+                    # write encoded chunks straight into a buffer instead of one big str + encode
+                    buf = BytesIO()
+                    common.to_csv(buf, index=False, encoding="utf-8")
+                    st.download_button("⬇️ Download Joined Data as CSV", buf.getvalue(), "joined_data.csv", "text/csv")
             else:
                 st.warning("No similar column names found to join automatically.")
                 st.write("File 1 Columns:", list(df1.columns))
@@ -120,7 +192,7 @@ if uploaded_file1 and uploaded_file2:
         else:
             if text1 and text2:
                 st.info("🧾 Comparing text content...")
-                common_text = find_common_text(text1, text2)
+                common_text = find_common_text(tuple(text1), tuple(text2))
                 if common_text:
                     st.success(f"✅ Found {len(common_text)} common lines!")
                     st.table(pd.DataFrame({"Common Lines": common_text}))